@@ -0,0 +1,126 @@
+"""==============================================================================
+ 
+ Title              :05_setting_river_map.py
+ Description        :Generate river channel length and stream order maps for SHETRAN
+ Author             :LF Velasquez - I Rohrmueller
+ Date               :Oct 2026
+ Version            :1.0
+ Usage              :05_setting_river_map.py
+ Notes              :
+                    - Before starting the process the files containing the sys 
+                      path and env path for qgis need to be created.
+                    - River lines are walked through the SHETRAN grid
+                      (see shetran_river.py) instead of selecting grid cells by
+                      location, the cost is linear in the number of segments.
+                    - order_field is the attribute with the stream order, lines
+                      without order or with an order below 1 (e.g. -9 or -9999
+                      used as no data) are given order 0.
+python version      :3.8.7
+ 
+=============================================================================="""
+# =============================================================================
+# Setting packages
+# =============================================================================
+
+import sys
+from pathlib import Path
+from shetran_bootstrap import Bootstrap
+from shetran_grid import GridStack
+from shetran_river import rasterize_rivers
+
+
+# =============================================================================
+# Global variables
+# =============================================================================
+
+# Setting path to work environment
+p = Path(__file__)
+dir_abs = p.parent.absolute()
+
+# Attribute of the river shapefile with the stream order
+order_field = 'ORDER'
+
+
+# =============================================================================
+# Setting up QGIS
+# =============================================================================
+
+# QGIS is only imported and started when first needed
+# No processing algorithms are used by this stage
+boot = Bootstrap(dir_abs, providers=[])
+
+# Checking inputs - a dry run (--dry-run) stops after this check
+inputs_ok = boot.check_inputs([dir_abs / 'QGIS_env/qgis_sys_paths.csv',
+                               dir_abs / 'QGIS_env/qgis_env.json',
+                               dir_abs / 'Data/inputs/rivers.shp'],
+                              upstream=[dir_abs / 'Data/outputs/SHETRAN_grid_stack.npz'])
+if boot.dry_run or not inputs_ok:
+    boot.finish()
+    sys.exit(0 if inputs_ok else 1)
+
+# Stage body - QGIS is shut down and timings reported even if it fails
+try:
+    # Starting QGIS
+    boot.qgis()
+    from qgis.core import QgsVectorLayer, NULL
+
+
+    # =============================================================================
+    # Start Process
+    # =============================================================================
+
+    # Step 1. Setting river shp ready for work
+    # Format: vlayer = QgsVectorLayer(data_source, layer_name, provider_name)
+    vlayer = QgsVectorLayer(str(Path(dir_abs / 'Data/inputs/rivers.shp')),
+    'River_layer', 'ogr')
+    if not vlayer.isValid():
+        print('River shapefile failed to load.')
+    else:
+        print('River shapefile loaded...')
+
+    # Step 2. Loading grid stack created with the catchment mask
+    stack_file = Path(dir_abs / 'Data/outputs/SHETRAN_grid_stack.npz')
+    stack = GridStack.load(stack_file)
+
+    # Step 3. Reading river lines as lists of vertices with their stream order
+    has_order = vlayer.fields().indexOf(order_field) >= 0
+    if not has_order:
+        print('Field ' + order_field + ' not found, all rivers set to order 0.')
+
+    def river_lines():
+        for f in vlayer.getFeatures():
+            geom = f.geometry()
+            order = f[order_field] if has_order else None
+            if order is None or order == NULL or int(order) < 1:
+                order = 0
+            if geom.isMultipart():
+                parts = geom.asMultiPolyline()
+            else:
+                parts = [geom.asPolyline()]
+            for part in parts:
+                yield [(pt.x(), pt.y()) for pt in part], order
+
+    # Step 4. Walking every river segment through the SHETRAN grid
+    river_length, river_order = rasterize_rivers(river_lines(), stack)
+
+    # Step 5. Adding river maps to the grid stack and saving them as text files
+    stack.add_layer('river_length', river_length)
+    stack.add_layer('river_order', river_order)
+    stack.save(stack_file)
+    stack.write_maps(Path(dir_abs / 'Data/outputs'), names=['river_length', 'river_order'])
+
+
+    # =============================================================================
+    # End Process
+    # =============================================================================
+
+    print('-----')
+    print('River maps created!! Go and check.')
+    print('-----')
+
+
+# =============================================================================
+# Exit the QGIS processing module and report start-up time, also when the stage fails
+# =============================================================================
+finally:
+    boot.finish()
@@ -0,0 +1,98 @@
+"""==============================================================================
+
+ Title              :06_setting_library_file.py
+ Description        :Write all SHETRAN maps and the SHETRAN library file
+ Author             :LF Velasquez - I Rohrmueller
+ Date               :Oct 2026
+ Version            :1.0
+ Usage              :06_setting_library_file.py
+ Notes              :
+                    - Run after the stages 01 to 05, which add their layers
+                      to Data/outputs/SHETRAN_grid_stack.npz.
+                    - The library file is built from a SHETRAN library file
+                      template (Data/inputs/LibraryFile_template.xml) with the
+                      vegetation and soil details, time series and dates of
+                      the catchment. Only the project name and the map file
+                      names are set here.
+                    - River maps are written but not referenced, the SHETRAN
+                      library file has no entry for them.
+                    - QGIS is not needed for this stage.
+python version      :3.8.7
+
+=============================================================================="""
+# =============================================================================
+# Setting packages
+# =============================================================================
+
+import sys
+from pathlib import Path
+from shetran_bootstrap import Bootstrap
+from shetran_grid import GridStack, LAYERS
+
+
+# =============================================================================
+# Global variables
+# =============================================================================
+
+# Setting path to work environment
+p = Path(__file__)
+dir_abs = p.parent.absolute()
+
+# Name of the catchment used in the library file
+catchment_name = 'catchm'
+
+
+# =============================================================================
+# Checking inputs
+# =============================================================================
+
+# No QGIS or processing providers are used by this stage
+boot = Bootstrap(dir_abs, providers=[])
+stack_file = Path(dir_abs / 'Data/outputs/SHETRAN_grid_stack.npz')
+template_file = Path(dir_abs / 'Data/inputs/LibraryFile_template.xml')
+
+# Checking inputs - a dry run (--dry-run) stops after this check
+inputs_ok = boot.check_inputs([template_file], upstream=[stack_file])
+if boot.dry_run or not inputs_ok:
+    boot.finish()
+    sys.exit(0 if inputs_ok else 1)
+
+# Stage body - QGIS is shut down and timings reported even if it fails
+try:
+    # =============================================================================
+    # Start Process
+    # =============================================================================
+
+    # Step 1. Loading grid stack created by the previous stages
+    stack = GridStack.load(stack_file)
+    # Layers referenced by the library file are required, river maps are optional
+    missing = [name for name in LAYERS if name not in stack.layers]
+    required = [name for name in missing if LAYERS[name][3] is not None]
+    if missing:
+        print('Layers missing from the grid stack: ' + ', '.join(missing))
+    if required:
+        print('Library file not written - run the stages creating: ' + ', '.join(required))
+        sys.exit(1)
+
+    # Step 2. Writing every SHETRAN map with the shared header in a single pass
+    stack.write_maps(Path(dir_abs / 'Data/outputs'))
+
+    # Step 3. Writing library file from the template, referencing the SHETRAN maps
+    library_file = Path(dir_abs / 'Data/outputs' / (catchment_name + '_LibraryFile.xml'))
+    stack.write_library(library_file, catchment_name, template_file)
+
+
+    # =============================================================================
+    # End Process
+    # =============================================================================
+
+    print('-----')
+    print('SHETRAN maps and library file created!! Go and check.')
+    print('-----')
+
+
+# =============================================================================
+# Report start-up time, also when the stage fails
+# =============================================================================
+finally:
+    boot.finish()
@@ -0,0 +1,158 @@
+"""==============================================================================
+
+ Title              :shetran_bootstrap.py
+ Description        :Lazy start-up of QGIS, processing providers and pandas
+ Author             :LF Velasquez - I Rohrmueller
+ Date               :Oct 2026
+ Version            :1.0
+ Usage              :from shetran_bootstrap import Bootstrap
+ Notes              :
+                    - Nothing is imported or started until a stage asks for
+                      it, so a dry run (--dry-run) only checks the inputs and
+                      parameters. Outputs of earlier stages are only warned
+                      about in a dry run so the whole pipeline can be checked
+                      on a fresh checkout.
+                    - Only the processing providers listed by the stage are
+                      loaded instead of running Processing.initialize().
+                    - The import and start-up time of each step is reported
+                      when the stage finishes.
+python version      :3.8.7
+
+=============================================================================="""
+# =============================================================================
+# Setting packages
+# =============================================================================
+
+import os
+import sys
+import csv
+import json
+import time
+import importlib
+from pathlib import Path
+
+
+# =============================================================================
+# Global variables
+# =============================================================================
+
+# Processing providers: name -> (module, provider class)
+PROVIDERS = {
+    'native' : ('qgis.analysis', 'QgsNativeAlgorithms'),
+    'qgis' : ('processing.algs.qgis.QgisAlgorithmProvider', 'QgisAlgorithmProvider'),
+    'gdal' : ('processing.algs.gdal.GdalAlgorithmProvider', 'GdalAlgorithmProvider'),
+    'saga' : ('processing.algs.saga.SagaAlgorithmProvider', 'SagaAlgorithmProvider'),
+}
+
+
+# =============================================================================
+# Bootstrap
+# =============================================================================
+
+class Bootstrap:
+    """Set up QGIS and the other heavy libraries of a stage on first use."""
+
+    def __init__(self, dir_abs, providers=()):
+        unknown = [name for name in providers if name not in PROVIDERS]
+        if unknown:
+            raise KeyError("Unknown processing provider(s): " + ', '.join(unknown))
+        self.dir_abs = Path(dir_abs)
+        self.providers = list(providers)
+        self.dry_run = '--dry-run' in sys.argv
+        self.timings = []
+        self._start = time.perf_counter()
+        self._env = None
+        self._qgs = None
+        self._processing = None
+        self._pandas = None
+
+    def _timed(self, label, func):
+        start = time.perf_counter()
+        result = func()
+        self.timings.append((label, time.perf_counter() - start))
+        return result
+
+    def check_inputs(self, files, upstream=()):
+        """Return True if all input files exist, printing the missing ones.
+
+        upstream lists files created by earlier stages. In a dry run they
+        may not exist yet, so they are only reported as warnings.
+        """
+        missing = [str(f) for f in files if not Path(f).exists()]
+        for f in missing:
+            print('Input file not found: ' + f)
+        missing_upstream = [str(f) for f in upstream if not Path(f).exists()]
+        for f in missing_upstream:
+            if self.dry_run:
+                print('Warning - output of an earlier stage not found yet: ' + f)
+            else:
+                print('Output of an earlier stage not found, run it first: ' + f)
+        return not missing and (self.dry_run or not missing_upstream)
+
+    def paths(self):
+        """Add the QGIS sys paths and environment variables (no imports)."""
+        if self._env is None:
+            # Setting up system paths
+            with open(self.dir_abs / 'QGIS_env/qgis_sys_paths.csv', newline='') as f:
+                sys.path += [row['paths'] for row in csv.DictReader(f)]
+            # Setting up environment variables
+            with open(self.dir_abs / 'QGIS_env/qgis_env.json', 'r') as f:
+                self._env = json.load(f)
+            for k, v in self._env.items():
+                os.environ[k] = v
+            # For mac OS we might need to map the PROJ_LIB to handle the projections
+            # os.environ['PROJ_LIB'] = '/Applications/QGIS-LTR.app/Contents/Resources/proj/'
+        return self._env
+
+    def qgis(self):
+        """Import qgis.core and start the QgsApplication."""
+        if self._qgs is None:
+            env = self.paths()
+            core = self._timed('import qgis', lambda: importlib.import_module('qgis.core'))
+
+            def start():
+                core.QgsApplication.setPrefixPath(env["HOME"], True)
+                qgs = core.QgsApplication([], False)
+                qgs.initQgis()
+                return qgs
+            self._qgs = self._timed('start QgsApplication', start)
+        return self._qgs
+
+    def processing(self):
+        """Import processing and load only the providers of the stage."""
+        if self._processing is None:
+            self.qgis()
+            from qgis.core import QgsApplication
+            self._processing = self._timed('import processing',
+                                           lambda: importlib.import_module('processing'))
+            from processing.core.ProcessingConfig import ProcessingConfig
+            self._timed('initialise processing config', ProcessingConfig.initialize)
+            registry = QgsApplication.processingRegistry()
+            for name in self.providers:
+                module, cls = PROVIDERS[name]
+
+                def load():
+                    provider = getattr(importlib.import_module(module), cls)()
+                    if not registry.addProvider(provider):
+                        raise RuntimeError("Processing provider '" + name + "' failed to load.")
+                self._timed('provider ' + name, load)
+        return self._processing
+
+    def pandas(self):
+        """Import pandas."""
+        if self._pandas is None:
+            self._pandas = self._timed('import pandas', lambda: importlib.import_module('pandas'))
+        return self._pandas
+
+    def report(self):
+        """Print the import and start-up time of each step."""
+        print('Start-up time (s):')
+        for label, seconds in self.timings:
+            print('  ' + label.ljust(32) + '%.2f' % seconds)
+        print('  ' + 'total run'.ljust(32) + '%.2f' % (time.perf_counter() - self._start))
+
+    def finish(self):
+        """Exit the QGIS application if it was started and report timings."""
+        if self._qgs is not None:
+            self._qgs.exitQgis()
+        self.report()
@@ -0,0 +1,181 @@
+"""==============================================================================
+
+ Title              :shetran_dem_ensemble.py
+ Description        :Monte Carlo DEM realizations for SHETRAN uncertainty analysis
+ Author             :LF Velasquez - I Rohrmueller
+ Date               :Oct 2026
+ Version            :1.0
+ Usage              :from shetran_dem_ensemble import dem_ensemble
+ Notes              :
+                    - Import after the QGIS sys paths have been set, GDAL is
+                      taken from the QGIS installation.
+                    - Spatially correlated noise is a normalised bilinear
+                      interpolation of white noise on a lattice spaced by the
+                      correlation length. Each lattice row is seeded from
+                      (seed, realization, lattice row) and only generated for
+                      the DEM window being processed, so results do not depend
+                      on the batch or window size.
+                    - Per DEM window the batch holds the DEM values, the
+                      lattice rows and the lattice interpolated on the pixel
+                      rows. The window height is chosen so these stay within
+                      max_block_pixels float32 values for the whole batch,
+                      plus a few temporaries of the same size. The floor is one
+                      pixel row and two lattice rows per realization, i.e.
+                      batch_size x (DEM columns + 3 x lattice columns).
+                      Lattice columns = grid width / corr_length + 2.
+python version      :3.8.7
+
+=============================================================================="""
+# =============================================================================
+# Setting packages
+# =============================================================================
+
+import numpy as np
+from osgeo import gdal
+
+
+# =============================================================================
+# Noise generation
+# =============================================================================
+
+def noise_rows(seed, first, count, lattice_rows, n_cols):
+    """White noise on some lattice rows for realizations first to first + count - 1.
+
+    Returns an array of shape (count, len(lattice_rows), n_cols).
+    """
+    lattice = np.empty((count, len(lattice_rows), n_cols), dtype=np.float32)
+    for k in range(count):
+        for j, row in enumerate(lattice_rows):
+            rng = np.random.default_rng([seed, first + k, int(row)])
+            lattice[k, j] = rng.standard_normal(n_cols, dtype=np.float32)
+    return lattice
+
+
+def interpolation_weights(dist, corr_length):
+    """Lattice index, bilinear weight and normalisation for pixel distances."""
+    pos = dist / corr_length
+    idx = np.floor(pos).astype(np.int64)
+    frac = (pos - idx).astype(np.float32)
+    # Dividing by the norm of the weights keeps the noise variance at one
+    norm = np.sqrt(frac ** 2 + (1 - frac) ** 2)
+    return idx, frac, norm
+
+
+def correlated_noise(lattice, iy, fy, ny, ix, fx, nx):
+    """Interpolate the lattice on a window of pixels, shape (batch, rows, cols)."""
+    rows = ((1 - fy)[None, :, None] * lattice[:, iy, :] +
+            fy[None, :, None] * lattice[:, iy + 1, :])
+    noise = ((1 - fx)[None, None, :] * rows[:, :, ix] +
+             fx[None, None, :] * rows[:, :, ix + 1])
+    noise /= ny[None, :, None] * nx[None, None, :]
+    return noise
+
+
+# =============================================================================
+# Ensemble of per cell statistics
+# =============================================================================
+
+def dem_ensemble(dem_file, stack, n_realizations, seed, sigma, corr_length,
+                 batch_size=50, max_block_pixels=2 ** 24):
+    """Yield per cell minimum and mean elevation of perturbed DEM realizations.
+
+    Realizations are computed in batches, for each batch the generator
+    yields (first realization index, dem_min, dem_mean) with arrays of shape
+    (batch, nrows, ncols) aligned with the grid stack. Cells without DEM
+    pixels are NaN.
+    """
+    ds = gdal.Open(str(dem_file))
+    if ds is None:
+        raise FileNotFoundError(str(dem_file) + " could not be opened.")
+    band = ds.GetRasterBand(1)
+    no_data = band.GetNoDataValue()
+    x0, dx, _, y0, _, dy = ds.GetGeoTransform()
+
+    # Step 1. Locating the SHETRAN cell of every pixel row and column
+    cs = stack.cellsize
+    x_left = stack.xllcorner
+    y_top = stack.yllcorner + stack.nrows * cs
+    dist_x = x0 + (np.arange(ds.RasterXSize) + 0.5) * dx - x_left
+    dist_y = y_top - (y0 + (np.arange(ds.RasterYSize) + 0.5) * dy)
+    cell_col = np.floor(dist_x / cs).astype(np.int64)
+    cell_row = np.floor(dist_y / cs).astype(np.int64)
+
+    # Columns of the raster inside the grid, pixels are sorted by cell column
+    in_cols = np.nonzero((cell_col >= 0) & (cell_col < stack.ncols))[0]
+    if in_cols.size == 0:
+        raise ValueError(str(dem_file) + " does not overlap the SHETRAN grid.")
+    if dx < 0:
+        raise ValueError(str(dem_file) + " must have west to east columns.")
+    xoff, xsize = int(in_cols[0]), int(in_cols.size)
+    cols_present, col_starts = np.unique(cell_col[xoff:xoff + xsize], return_index=True)
+    ix, fx, nx = interpolation_weights(dist_x[xoff:xoff + xsize], corr_length)
+
+    # Step 2. Window height keeping DEM values and lattice rows within the budget
+    # Lattice columns only cover the raster columns inside the grid
+    ix = ix - ix.min()
+    lattice_cols = int(ix.max()) + 2
+    per_row = xsize + lattice_cols * (1 + abs(dy) / corr_length)
+    block_rows = int((max_block_pixels / batch_size - 2 * lattice_cols) // per_row)
+    block_rows = max(1, block_rows)
+
+    for first in range(0, n_realizations, batch_size):
+        count = min(batch_size, n_realizations - first)
+        dem_min = np.full((count, stack.nrows, stack.ncols), np.nan)
+        dem_mean = np.full((count, stack.nrows, stack.ncols), np.nan)
+
+        # Step 3. Walking the raster one row of SHETRAN cells at a time
+        for r in range(stack.nrows):
+            pix_rows = np.nonzero(cell_row == r)[0]
+            if pix_rows.size == 0:
+                continue
+            total = np.zeros((count, cols_present.size))
+            valid_count = np.zeros(cols_present.size)
+            low = np.full((count, cols_present.size), np.inf)
+
+            # Windows of at most block_rows pixel rows keep memory bounded
+            for yoff in range(int(pix_rows[0]), int(pix_rows[-1]) + 1, block_rows):
+                ysize = min(block_rows, int(pix_rows[-1]) + 1 - yoff)
+                dem = band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float32)
+                valid = np.isfinite(dem)
+                if no_data is not None:
+                    valid &= dem != no_data
+                iy, fy, ny = interpolation_weights(dist_y[yoff:yoff + ysize], corr_length)
+                # Lattice rows needed by this window only
+                lattice_rows = np.arange(iy.min(), iy.max() + 2)
+                lattice = noise_rows(seed, first, count, lattice_rows, lattice_cols)
+                noise = correlated_noise(lattice, iy - iy.min(), fy, ny, ix, fx, nx)
+                values = dem[None] + sigma * noise
+
+                # Per cell sums and minimums over the window
+                summed = np.where(valid[None], values, 0).sum(axis=1, dtype=np.float64)
+                lowest = np.where(valid[None], values, np.inf).min(axis=1)
+                total += np.add.reduceat(summed, col_starts, axis=1)
+                valid_count += np.add.reduceat(valid.sum(axis=0), col_starts)
+                low = np.minimum(low, np.minimum.reduceat(lowest, col_starts, axis=1))
+
+            has_data = valid_count > 0
+            dem_mean[:, r, cols_present[has_data]] = total[:, has_data] / valid_count[has_data]
+            dem_min[:, r, cols_present[has_data]] = low[:, has_data]
+
+        yield first, dem_min, dem_mean
+
+
+class EnsembleSummary:
+    """Running ensemble mean and spread (standard deviation) per cell."""
+
+    def __init__(self, shape):
+        self.count = 0
+        self.total = np.zeros(shape)
+        self.total_sq = np.zeros(shape)
+
+    def update(self, batch):
+        self.count += batch.shape[0]
+        self.total += batch.sum(axis=0)
+        self.total_sq += (batch ** 2).sum(axis=0)
+
+    def mean(self):
+        return self.total / self.count
+
+    def spread(self):
+        var = self.total_sq / self.count - self.mean() ** 2
+        return np.sqrt(np.maximum(var, 0))
@@ -0,0 +1,225 @@
+"""==============================================================================
+
+ Title              :shetran_grid.py
+ Description        :Shared grid stack used to write the SHETRAN maps
+ Author             :LF Velasquez - I Rohrmueller
+ Date               :Oct 2026
+ Version            :1.0
+ Usage              :from shetran_grid import GridStack
+ Notes              :
+                    - All layers share the georeference of the catchment mask,
+                      any layer with a different extent is rejected.
+                    - xllcorner/yllcorner are the lower left corner of the grid
+                      (not the centroid of the lower left cell).
+                    - The stack is kept in Data/outputs/SHETRAN_grid_stack.npz
+                      so each stage adds its layer to the same cube.
+python version      :3.8.7
+
+=============================================================================="""
+# =============================================================================
+# Setting packages
+# =============================================================================
+
+import numpy as np
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+
+# =============================================================================
+# Global variables
+# =============================================================================
+
+CELLSIZE = 5000
+NO_DATA_VAL = -9999
+
+# SHETRAN map written for each layer of the stack:
+# layer name -> (output file name, numpy dtype, text format, library file tag)
+# The SHETRAN library file has no entry for river maps (SHETRAN derives the
+# channels from the DEM), they are written but not referenced in it
+LAYERS = {
+    'mask' : ('final_mask_SHETRAN.txt', np.int32, '%d', 'MaskFileName'),
+    'dem_mean' : ('final_dem_mean_SHETRAN.txt', np.float64, '%d', 'DEMMeanFileName'),
+    'dem_min' : ('final_dem_min_SHETRAN.txt', np.float64, '%d', 'DEMminFileName'),
+    'land_cover' : ('final_land_cover_SHETRAN.txt', np.int32, '%d', 'VegMap'),
+    'lake' : ('final_lake_map_SHETRAN.txt', np.int32, '%d', 'LakeMap'),
+    'river_length' : ('final_river_length_SHETRAN.txt', np.float64, '%.1f', None),
+    'river_order' : ('final_river_order_SHETRAN.txt', np.int32, '%d', None),
+}
+
+# Library file sections that are not generated here and must come from the template
+LIBRARY_SECTIONS = ['VegetationDetails', 'SoilProperties', 'SoilDetails',
+                    'PrecipitationTimeSeriesData', 'EvaporationTimeSeriesData',
+                    'StartDay', 'StartMonth', 'StartYear',
+                    'EndDay', 'EndMonth', 'EndYear']
+
+
+# =============================================================================
+# Grid stack
+# =============================================================================
+
+class GridStack:
+    """Aligned SHETRAN layers sharing one georeference.
+
+    Layers are stored as typed numpy arrays ordered as SHETRAN reads them,
+    i.e. first row is the northernmost row of cells.
+    """
+
+    def __init__(self, ncols, nrows, xllcorner, yllcorner,
+                 cellsize=CELLSIZE, no_data_val=NO_DATA_VAL):
+        self.ncols = int(ncols)
+        self.nrows = int(nrows)
+        self.xllcorner = int(xllcorner)
+        self.yllcorner = int(yllcorner)
+        self.cellsize = int(cellsize)
+        self.no_data_val = int(no_data_val)
+        self.layers = {}
+
+    @property
+    def georef(self):
+        return (self.ncols, self.nrows, self.xllcorner, self.yllcorner,
+                self.cellsize, self.no_data_val)
+
+    @classmethod
+    def from_pivot(cls, df_pivot, cellsize=CELLSIZE, no_data_val=NO_DATA_VAL):
+        """Create an empty stack with the extent of a pivoted dataframe.
+
+        The dataframe must use X as columns and Y as rows sorted descending,
+        as produced by the stage scripts. X and Y are cell centroids, the
+        lower left corner of the grid is half a cell away from the first one.
+        """
+        return cls(ncols=df_pivot.shape[1],
+                   nrows=df_pivot.shape[0],
+                   xllcorner=int(round(list(df_pivot.columns)[0] - cellsize / 2)),
+                   yllcorner=int(round(df_pivot.index[-1] - cellsize / 2)),
+                   cellsize=cellsize,
+                   no_data_val=no_data_val)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a stack saved with GridStack.save."""
+        with np.load(filename) as cube:
+            stack = cls(*cube['georef'])
+            for name in cube['names']:
+                stack.layers[str(name)] = cube[str(name)]
+        return stack
+
+    def save(self, filename):
+        """Save georeference and all layers in a single npz file."""
+        arrays = dict(self.layers)
+        arrays['georef'] = np.array(self.georef, dtype=np.int64)
+        arrays['names'] = np.array(list(self.layers), dtype=str)
+        np.savez(filename, **arrays)
+
+    def check_pivot(self, name, df_pivot):
+        """Raise ValueError if a pivoted dataframe does not match the stack extent."""
+        other = GridStack.from_pivot(df_pivot, self.cellsize, self.no_data_val)
+        if other.georef != self.georef:
+            raise ValueError(
+                "Layer '" + name + "' is not aligned with the grid stack: "
+                "ncols, nrows, xllcorner, yllcorner = " + str(other.georef[:4]) +
+                ", expected " + str(self.georef[:4]))
+
+    def add_pivot(self, name, df_pivot):
+        """Add a pivoted dataframe as a layer after checking its extent."""
+        self.check_pivot(name, df_pivot)
+        self.add_layer(name, df_pivot.values)
+
+    def add_layer(self, name, values):
+        """Add an array as a layer, missing values are set to NODATA."""
+        if name not in LAYERS:
+            raise KeyError("Unknown SHETRAN layer '" + name + "'")
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (self.nrows, self.ncols):
+            raise ValueError(
+                "Layer '" + name + "' has shape " + str(values.shape) +
+                ", expected " + str((self.nrows, self.ncols)))
+        values = np.where(np.isnan(values), self.no_data_val, values)
+        self.layers[name] = values.astype(LAYERS[name][1])
+
+    def header(self):
+        """Header needed for SHETRAN, shared by every map of the stack."""
+        return ("ncols         " + str(self.ncols) + "\n" +
+                "nrows         " + str(self.nrows) + "\n" +
+                "xllcorner     " + str(self.xllcorner) + "\n" +
+                "yllcorner     " + str(self.yllcorner) + "\n" +
+                "cellsize      " + str(self.cellsize) + "\n" +
+                "NODATA_value  " + str(self.no_data_val))
+
+    def write_maps(self, out_dir, names=None):
+        """Write header and values of each layer in one pass per file.
+
+        Returns a dictionary with the path written for each layer.
+        """
+        names = list(self.layers) if names is None else names
+        written = {}
+        for name in names:
+            filename = Path(out_dir) / LAYERS[name][0]
+            self.write_grid(filename, self.layers[name], LAYERS[name][2])
+            written[name] = filename
+        return written
+
+    def write_grid(self, filename, values, fmt='%d'):
+        """Write any array with the stack extent as a SHETRAN map.
+
+        Missing values are written as NODATA.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (self.nrows, self.ncols):
+            raise ValueError(
+                str(filename) + " has shape " + str(values.shape) +
+                ", expected " + str((self.nrows, self.ncols)))
+        values = np.where(np.isnan(values), self.no_data_val, values)
+        np.savetxt(filename, values, fmt=fmt, header=self.header(), comments='')
+        return filename
+
+    def write_library(self, filename, catchment_name, template):
+        """Write the SHETRAN library (XML) file from a template.
+
+        The template is a complete SHETRAN library file for the catchment
+        (vegetation and soil details, time series, dates...). The project
+        name, catchment name and the maps of the stack are set on a copy of it.
+        Every layer referenced by the library file must be in the stack, so no
+        map name of the template is left behind.
+        """
+        missing = [name for name in LAYERS
+                   if LAYERS[name][3] is not None and name not in self.layers]
+        if missing:
+            raise ValueError("Layer(s) missing from the grid stack: " + ', '.join(missing))
+        tree = ET.parse(str(template))
+        root = tree.getroot()
+        if root.tag != 'ShetranInput':
+            raise ValueError(str(template) + " is not a SHETRAN library file.")
+        missing = [tag for tag in LIBRARY_SECTIONS if root.find(tag) is None]
+        if missing:
+            raise ValueError(str(template) + " is missing the section(s): " +
+                             ', '.join(missing))
+
+        def set_section(tag, text):
+            section = root.find(tag)
+            if section is None:
+                section = ET.SubElement(root, tag)
+            section.text = text
+
+        set_section('ProjectFile', catchment_name)
+        set_section('CatchmentName', catchment_name)
+        for name in LAYERS:
+            if LAYERS[name][3] is not None:
+                set_section(LAYERS[name][3], LAYERS[name][0])
+        tree.write(str(filename), encoding='utf-8', xml_declaration=True)
+        return filename
+
+
+def update_stack(filename, name, df_pivot, out_dir):
+    """Add a pivoted layer to the saved stack and write its SHETRAN map.
+
+    The stack must have been created by 01_setting_mask.py so that every
+    layer is checked against the catchment mask extent.
+    """
+    filename = Path(filename)
+    if not filename.exists():
+        raise FileNotFoundError(
+            str(filename) + " not found - run 01_setting_mask.py first.")
+    stack = GridStack.load(filename)
+    stack.add_pivot(name, df_pivot)
+    stack.save(filename)
+    return stack.write_maps(out_dir, names=[name])[name]
@@ -0,0 +1,202 @@
+"""==============================================================================
+
+ Title              :shetran_river.py
+ Description        :Rasterize river lines on the SHETRAN grid
+ Author             :LF Velasquez - I Rohrmueller
+ Date               :Oct 2026
+ Version            :1.0
+ Usage              :from shetran_river import rasterize_rivers
+ Notes              :
+                    - Each segment is walked cell by cell through the regular
+                      grid (Amanatides & Woo grid traversal), so the cost is
+                      linear in the number of segments and crossed cells.
+                    - Crossed cells are buffered in compact arrays and added to
+                      the grid every chunk_size crossings. Lengths per stream
+                      order are kept sparse, so memory depends on the cell and
+                      order pairs found, not on the number of segments or on
+                      the largest order.
+python version      :3.8.7
+
+=============================================================================="""
+# =============================================================================
+# Setting packages
+# =============================================================================
+
+import math
+import numpy as np
+from array import array
+
+
+# =============================================================================
+# Global variables
+# =============================================================================
+
+# Tolerance in grid units: boundary crossings closer than this are taken as
+# one crossing (through a cell corner) and shorter pieces are ignored
+TOLERANCE = 1e-9
+
+
+# =============================================================================
+# Grid traversal
+# =============================================================================
+
+def clip_segment(u0, v0, u1, v1, ncols, nrows):
+    """Clip a segment in grid units to the grid (Liang-Barsky).
+
+    Returns the clipped segment or None if it is outside of the grid.
+    """
+    t0, t1 = 0.0, 1.0
+    du, dv = u1 - u0, v1 - v0
+    for p, q in ((-du, u0), (du, ncols - u0), (-dv, v0), (dv, nrows - v0)):
+        if p == 0:
+            if q < 0:
+                return None
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+    if t0 >= t1:
+        return None
+    return u0 + t0 * du, v0 + t0 * dv, u0 + t1 * du, v0 + t1 * dv
+
+
+def first_last_cell(a0, a1):
+    """First and last cell crossed along one axis, following the direction."""
+    if a1 > a0:
+        return math.floor(a0), math.ceil(a1) - 1
+    if a1 < a0:
+        return math.ceil(a0) - 1, math.floor(a1)
+    return math.floor(a0), math.floor(a0)
+
+
+def traverse_segment(u0, v0, u1, v1):
+    """Yield (row, col, fraction of the segment) for every cell crossed.
+
+    Coordinates are in grid units, u increases with the column and v with
+    the row.
+    """
+    du, dv = u1 - u0, v1 - v0
+    col, last_col = first_last_cell(u0, u1)
+    row, last_row = first_last_cell(v0, v1)
+    step_col = 1 if du > 0 else -1
+    step_row = 1 if dv > 0 else -1
+    # Segment parameter t where the next column and row boundaries are crossed
+    if du != 0:
+        t_col = ((col + 1 - u0) if du > 0 else (u0 - col)) / abs(du)
+        dt_col = 1 / abs(du)
+    else:
+        t_col, dt_col = math.inf, math.inf
+    if dv != 0:
+        t_row = ((row + 1 - v0) if dv > 0 else (v0 - row)) / abs(dv)
+        dt_row = 1 / abs(dv)
+    else:
+        t_row, dt_row = math.inf, math.inf
+
+    # Crossings closer than the tolerance (scaled to t) happen at a corner
+    tol = TOLERANCE / max(abs(du), abs(dv), TOLERANCE)
+    t = 0.0
+    while col != last_col or row != last_row:
+        if col != last_col and row != last_row and abs(t_col - t_row) <= tol:
+            # Passing through a corner, moving to the diagonal cell
+            t_next = min(t_col, t_row)
+            yield row, col, t_next - t
+            t, col, row = t_next, col + step_col, row + step_row
+            t_col, t_row = t_col + dt_col, t_row + dt_row
+        elif row == last_row or (col != last_col and t_col < t_row):
+            yield row, col, t_col - t
+            t, t_col, col = t_col, t_col + dt_col, col + step_col
+        else:
+            yield row, col, t_row - t
+            t, t_row, row = t_row, t_row + dt_row, row + step_row
+    yield row, col, 1.0 - t
+
+
+# =============================================================================
+# River rasterization
+# =============================================================================
+
+def add_pairs(pairs, cells, orders, lengths):
+    """Add lengths to the sparse (cell, order) totals.
+
+    pairs is a tuple of arrays (cells, orders, lengths) with unique
+    (cell, order) pairs, or None when empty.
+    """
+    if pairs is not None:
+        cells = np.concatenate([pairs[0], cells])
+        orders = np.concatenate([pairs[1], orders])
+        lengths = np.concatenate([pairs[2], lengths])
+    keys, inverse = np.unique(np.stack([cells, orders], axis=1), axis=0,
+                              return_inverse=True)
+    totals = np.bincount(inverse.ravel(), lengths, minlength=keys.shape[0])
+    return keys[:, 0], keys[:, 1], totals
+
+
+def rasterize_rivers(lines, stack, chunk_size=10 ** 6):
+    """Channel length and dominant stream order for every cell of the stack.
+
+    lines is an iterable of (vertices, order) where vertices is a list of
+    (x, y) map coordinates of a polyline and order its stream order, a
+    non-negative integer (0 for unknown order).
+    The dominant order of a cell is the order with the largest channel length
+    in the cell, the highest order wins ties. Cells without river are NaN.
+    """
+    cs = stack.cellsize
+    x_left = stack.xllcorner
+    y_top = stack.yllcorner + stack.nrows * cs
+    n_cells = stack.nrows * stack.ncols
+    total = np.zeros(n_cells)
+    pairs = None
+    cells, orders, lengths = array('q'), array('q'), array('d')
+
+    def flush():
+        nonlocal pairs
+        if not cells:
+            return
+        c = np.frombuffer(cells, dtype=np.int64).copy()
+        o = np.frombuffer(orders, dtype=np.int64).copy()
+        l = np.frombuffer(lengths, dtype=np.float64).copy()
+        total[:] += np.bincount(c, l, minlength=n_cells)
+        pairs = add_pairs(pairs, c, o, l)
+        del cells[:], orders[:], lengths[:]
+
+    # Step 1. Walking every segment of every line through the grid
+    for vertices, order in lines:
+        order = int(order)
+        if order < 0:
+            raise ValueError("Stream order must not be negative, got " + str(order) +
+                             " - set unknown orders to 0.")
+        for (x0, y0), (x1, y1) in zip(vertices[:-1], vertices[1:]):
+            clipped = clip_segment((x0 - x_left) / cs, (y_top - y0) / cs,
+                                   (x1 - x_left) / cs, (y_top - y1) / cs,
+                                   stack.ncols, stack.nrows)
+            if clipped is None:
+                continue
+            u0, v0, u1, v1 = clipped
+            clip_length = math.hypot(u1 - u0, v1 - v0) * cs
+            for row, col, fraction in traverse_segment(u0, v0, u1, v1):
+                if fraction * clip_length <= TOLERANCE * cs or not (0 <= row < stack.nrows and 0 <= col < stack.ncols):
+                    continue
+                cells.append(row * stack.ncols + col)
+                orders.append(order)
+                lengths.append(fraction * clip_length)
+            if len(cells) >= chunk_size:
+                flush()
+    flush()
+
+    # Step 2. Picking the dominant order of each cell
+    length = np.full(n_cells, np.nan)
+    dominant = np.full(n_cells, np.nan)
+    has_river = total > TOLERANCE * cs
+    length[has_river] = total[has_river]
+    if pairs is not None:
+        pair_cells, pair_orders, pair_lengths = pairs
+        # Sorting by cell, then length, then order: the last pair of each cell wins
+        idx = np.lexsort((pair_orders, pair_lengths, pair_cells))
+        last = np.append(pair_cells[idx][1:] != pair_cells[idx][:-1], True)
+        dominant[pair_cells[idx][last]] = pair_orders[idx][last]
+        dominant[~has_river] = np.nan
+
+    return (length.reshape(stack.nrows, stack.ncols),
+            dominant.reshape(stack.nrows, stack.ncols))
@@ -0,0 +1,41 @@
+"""Regression checks for the river grid traversal (no QGIS needed)."""
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from shetran_grid import GridStack
+from shetran_river import rasterize_rivers, traverse_segment
+
+
+def river_cells(length):
+    return set(zip(*np.nonzero(~np.isnan(length))))
+
+
+def test_diagonal_through_corners_only_touches_crossed_cells():
+    stack = GridStack(4, 3, 0, 0, 5000)
+    length, order = rasterize_rivers([([(1000, 1000), (11000, 11000)], 1)], stack)
+    # Rows are numbered from the top, the line goes up and to the right
+    assert river_cells(length) == {(2, 0), (1, 1), (0, 2)}
+    assert river_cells(order) == {(2, 0), (1, 1), (0, 2)}
+    assert np.isclose(np.nansum(length), 10000 * 2 ** 0.5)
+
+
+def test_corner_step_is_diagonal():
+    pieces = list(traverse_segment(0.5, 0.5, 2.5, 2.5))
+    assert [(r, c) for r, c, _ in pieces] == [(0, 0), (1, 1), (2, 2)]
+    assert np.isclose(sum(f for _, _, f in pieces), 1.0)
+
+
+def test_segment_along_cell_boundary_is_in_one_row():
+    stack = GridStack(4, 3, 0, 0, 100)
+    length, _ = rasterize_rivers([([(0, 100), (400, 100)], 2)], stack)
+    assert len(river_cells(length)) == 4
+    assert np.allclose(length[~np.isnan(length)], 100)
+
+
+def test_segment_ending_on_boundary_adds_no_empty_cell():
+    stack = GridStack(4, 3, 0, 0, 100)
+    length, _ = rasterize_rivers([([(50, 50), (200, 50)], 1)], stack)
+    assert river_cells(length) == {(2, 0), (2, 1)}